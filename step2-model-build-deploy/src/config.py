@@ -17,6 +17,11 @@ DEFAULT_N_COMPONENTS = 1
 DEFAULT_INSTANCE_TYPE = 'ml.m5.large'
 DEFAULT_FRAMEWORK_VERSION = '1.2-1'
 
+# Inference micro-batching: concurrent requests are coalesced until either
+# limit is reached (BATCH_SIZE <= 1 disables batching)
+BATCH_SIZE = int(os.environ.get('BATCH_SIZE', '32'))
+BATCH_MAX_DELAY_MS = float(os.environ.get('BATCH_MAX_DELAY_MS', '10'))
+
 # Environment variables for SageMaker consistency
 SAGEMAKER_ENV_VARS = {
     'MODEL_DIR': MODEL_DIR,
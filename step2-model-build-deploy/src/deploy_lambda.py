@@ -29,25 +29,18 @@ def lambda_handler(event, context):
         }]
     )
 
-    # Check if endpoint exists
+    # Create endpoint, falling back to an update when it already exists
     try:
-        sm.describe_endpoint(EndpointName=endpoint_name)
-        exists = True
+        print(f"Creating endpoint: {endpoint_name}")
+        sm.create_endpoint(EndpointName=endpoint_name, EndpointConfigName=config_name)
+        action = "create"
     except ClientError as e:
-        if e.response["Error"]["Code"] == "ValidationException":
-            exists = False
-        else:
+        error = e.response["Error"]
+        if error["Code"] != "ValidationException" or "already exist" not in error.get("Message", ""):
             raise
-
-    # Create or update endpoint
-    if exists:
         print(f"Updating endpoint: {endpoint_name}")
         sm.update_endpoint(EndpointName=endpoint_name, EndpointConfigName=config_name)
         action = "update"
-    else:
-        print(f"Creating endpoint: {endpoint_name}")
-        sm.create_endpoint(EndpointName=endpoint_name, EndpointConfigName=config_name)
-        action = "create"
 
     return {
         "statusCode": 200,
@@ -7,24 +7,184 @@ import pandas as pd
 import numpy as np
 import os
 import logging
+import queue
 import sys
+import threading
+import time
 from io import StringIO
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa_csv = None
+
 sys.path.append(os.path.dirname(__file__))
-from preprocessing import prepare_features_for_training, get_numerical_features
+from preprocessing import prepare_features_for_training, prepare_record_features
+from config import BATCH_SIZE, BATCH_MAX_DELAY_MS
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+
+REQUIRED_COLUMNS = frozenset(('Age', 'Income', 'Purchases', 'Gender'))
+
+WARMUP_ITERATIONS = 3
+
+# Quartile edges computed from fewer rows collapse, so legacy artifacts need this many per request
+MIN_ROWS_WITHOUT_STATS = 4
+
+# np.linalg.norm orders matching sklearn Normalizer norms
+_NORM_ORDERS = {'l1': 1, 'l2': 2, 'max': np.inf}
+
+# Result of the warmup pass for this worker, set once by warmup()
+_WARMUP = None
+
+# Micro-batcher shared by all request threads of this worker, created on first use
+_BATCHER = None
+_BATCHER_LOCK = threading.Lock()
+
+
+class _MicroBatcher:
+    """Coalesce concurrent requests into a single pipeline run on a background thread."""
+    
+    def __init__(self, model, max_size, max_delay_ms):
+        self.model = model
+        self._max_size = max_size
+        self._max_delay = max_delay_ms / 1000.0
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, name='inference-batcher', daemon=True).start()
+    
+    def submit(self, input_data):
+        """Queue input_data and block until its results are available."""
+        done = threading.Event()
+        slot = {}
+        self._queue.put((input_data, done, slot))
+        done.wait()
+        if 'error' in slot:
+            raise slot['error']
+        return slot['results']
+    
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            n_rows = len(batch[0][0])
+            deadline = time.monotonic() + self._max_delay
+            
+            while n_rows < self._max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                n_rows += len(item[0])
+                
+            self._process(batch)
+    
+    def _process(self, batch):
+        try:
+            frames = [input_data for input_data, _, _ in batch]
+            combined = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+            results = _predict_records(combined, self.model)
+            
+            offset = 0
+            for input_data, _, slot in batch:
+                slot['results'] = results[offset:offset + len(input_data)]
+                offset += len(input_data)
+        except Exception as e:
+            if len(batch) > 1:
+                # Isolate the failing request instead of failing the whole batch
+                for item in batch:
+                    self._process([item])
+                return
+            batch[0][2]['error'] = e
+        finally:
+            for _, done, _ in batch:
+                done.set()
+
+
+def _get_batcher(model):
+    """Return the worker's micro-batcher for model, creating it if needed."""
+    global _BATCHER
+    
+    with _BATCHER_LOCK:
+        if _BATCHER is None or _BATCHER.model is not model:
+            _BATCHER = _MicroBatcher(model, BATCH_SIZE, BATCH_MAX_DELAY_MS)
+        return _BATCHER
+
+
+def warmup(model):
+    """Run dummy predictions so the first request does not pay lazy-initialization costs."""
+    global _WARMUP
+    
+    dummy = pd.DataFrame({
+        'Customer_ID': [0, 1, 2, 3],
+        'Age': [25, 38, 47, 63],
+        'Income': [42000, 76000, 98000, 131000],
+        'Purchases': [8, 19, 31, 44],
+        'Gender': ['Male', 'Female', 'Male', 'Female']
+    })
+    
+    timings = []
+    try:
+        for _ in range(WARMUP_ITERATIONS):
+            start = time.perf_counter()
+            predict_fn(dummy, model)
+            if model['feature_stats'] is not None:
+                predict_fn(dummy.head(1), model)
+            timings.append(time.perf_counter() - start)
+    except Exception as e:
+        logger.warning("Warmup failed: %s", e)
+        
+    _WARMUP = {'iterations': len(timings), 'timings_ms': [t * 1000 for t in timings]}
+    logger.info("Warmup completed: %s", _WARMUP)
+    return _WARMUP
+
+
+def _fuse_pca_kmeans(pca_model, kmeans_model):
+    """Precompute the arrays needed to project onto PCA space and score cluster distances in one pass.
+    
+    Arrays are kept in float32, which is ample precision for this model and halves memory traffic.
+    """
+    components = pca_model.components_
+    if pca_model.whiten:
+        components = components / np.sqrt(pca_model.explained_variance_)[:, np.newaxis]
+    components = components.astype(np.float32)
+        
+    centers = kmeans_model.cluster_centers_.astype(np.float32)
+    
+    return {
+        'pca_mean': pca_model.mean_.astype(np.float32),
+        'pca_components_t': np.ascontiguousarray(components.T),
+        'cluster_centers_t': np.ascontiguousarray(centers.T),
+        'center_sq_norms': (centers ** 2).sum(axis=1)
+    }
 
 
 def model_fn(model_dir):
     """Load model artifacts."""
-    logger.info(f"Loading models from {model_dir}")
+    logger.info("Loading models from %s", model_dir)
     
     try:
-        normalizer = joblib.load(os.path.join(model_dir, 'normalizer.pkl'))
-        pca_model = joblib.load(os.path.join(model_dir, 'pca_model.pkl'))
-        kmeans_model = joblib.load(os.path.join(model_dir, 'kmeans_model.pkl'))
+        # Memory-map array data so pages load lazily and are shared between workers
+        normalizer = joblib.load(os.path.join(model_dir, 'normalizer.pkl'), mmap_mode='r')
+        pca_model = joblib.load(os.path.join(model_dir, 'pca_model.pkl'), mmap_mode='r')
+        kmeans_model = joblib.load(os.path.join(model_dir, 'kmeans_model.pkl'), mmap_mode='r')
+        
+        # Older artifacts predate persisted statistics; fall back to per-batch statistics
+        feature_stats_path = os.path.join(model_dir, 'feature_stats.pkl')
+        feature_stats = joblib.load(feature_stats_path, mmap_mode='r') if os.path.exists(feature_stats_path) else None
+        if feature_stats is None:
+            logger.warning("No feature_stats.pkl in %s; predictions depend on the other rows in each request "
+                           "and requests need at least %d rows. Retrain to persist training statistics.",
+                           model_dir, MIN_ROWS_WITHOUT_STATS)
         
         with open(os.path.join(model_dir, 'cluster_names.json'), 'r') as f:
             cluster_names = json.load(f)
@@ -34,26 +194,53 @@ def model_fn(model_dir):
             
         logger.info("Models loaded successfully")
         
-        return {
+        model = {
             'normalizer': normalizer,
             'pca_model': pca_model,
             'kmeans_model': kmeans_model,
+            'fused': _fuse_pca_kmeans(pca_model, kmeans_model),
+            'feature_stats': feature_stats,
             'cluster_names': cluster_names,
             'metadata': metadata
         }
+        warmup(model)
+        
+        return model
         
     except Exception as e:
-        logger.error(f"Error loading models: {str(e)}")
+        logger.error("Error loading models: %s", e)
         raise
 
 
+def _json_loads(data):
+    """Decode JSON, using orjson when it is installed."""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def _json_dumps(obj):
+    """Encode obj as a JSON string, using orjson when it is installed."""
+    if orjson is None:
+        return json.dumps(obj)
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+
+def _read_csv(request_body):
+    """Parse a CSV payload, using pyarrow's multi-threaded parser when it is installed."""
+    if pa_csv is None:
+        return pd.read_csv(StringIO(request_body))
+    
+    if isinstance(request_body, str):
+        request_body = request_body.encode()
+    return pa_csv.read_csv(pa.BufferReader(request_body)).to_pandas()
+
+
 def input_fn(request_body, content_type):
     """Parse and validate input data."""
-    logger.info(f"Processing input: {content_type}")
+    logger.info("Processing input: %s", content_type)
     
     try:
         if content_type == 'application/json':
-            input_data = json.loads(request_body)
+            input_data = _json_loads(request_body)
             
             if 'instances' in input_data:
                 df = pd.DataFrame(input_data['instances'])
@@ -65,62 +252,115 @@ def input_fn(request_body, content_type):
                 raise ValueError("Unsupported JSON format")
                 
         elif content_type == 'text/csv':
-            df = pd.read_csv(StringIO(request_body))
+            df = _read_csv(request_body)
         else:
             raise ValueError(f"Unsupported content type: {content_type}")
             
         # Validate required columns
-        required_columns = ['Age', 'Income', 'Purchases', 'Gender']
-        missing_columns = [col for col in required_columns if col not in df.columns]
+        missing_columns = REQUIRED_COLUMNS.difference(df.columns)
         if missing_columns:
-            raise ValueError(f"Missing required columns: {missing_columns}")
+            raise ValueError(f"Missing required columns: {sorted(missing_columns)}")
             
         if 'Customer_ID' not in df.columns:
-            df['Customer_ID'] = range(len(df))
+            df['Customer_ID'] = np.arange(len(df), dtype=np.int32)
             
-        logger.info(f"Input validated: {df.shape}")
+        logger.info("Input validated: %s", df.shape)
         return df
         
     except Exception as e:
-        logger.error(f"Error processing input: {str(e)}")
+        logger.error("Error processing input: %s", e)
         raise
 
 
+def _predict_records(input_data, model):
+    """Run the feature pipeline and clustering, returning one result dict per row."""
+    normalizer = model['normalizer']
+    fused = model['fused']
+    cluster_names = model['cluster_names']
+    
+    df_continuous, df_binary = prepare_features_for_training(input_data, model['feature_stats'])
+    df_continuous = df_continuous.astype(np.float32, copy=False)
+    n_continuous = df_continuous.shape[1]
+    
+    # Normalized continuous features followed by binary features, in one contiguous buffer
+    features = np.empty((len(df_continuous), n_continuous + df_binary.shape[1]), dtype=np.float32)
+    features[:, :n_continuous] = normalizer.transform(df_continuous)
+    features[:, n_continuous:] = df_binary.to_numpy(np.float32)
+    
+    # PCA projection followed by squared distances to every cluster center:
+    # ||p - c||^2 = ||p||^2 - 2 p.c + ||c||^2
+    pca_features = (features - fused['pca_mean']) @ fused['pca_components_t']
+    sq_distances = (
+        (pca_features ** 2).sum(axis=1, keepdims=True)
+        - 2 * (pca_features @ fused['cluster_centers_t'])
+        + fused['center_sq_norms']
+    )
+    np.maximum(sq_distances, 0, out=sq_distances)
+    
+    cluster_predictions = sq_distances.argmin(axis=1)
+    min_distances = np.sqrt(sq_distances[np.arange(len(sq_distances)), cluster_predictions])
+    
+    # Convert to Python scalars in bulk rather than per sample
+    clusters = cluster_predictions.tolist()
+    distances = min_distances.tolist()
+    confidences = (1.0 / (1.0 + min_distances)).tolist()
+    segment_names = [cluster_names.get(str(cluster), f"Cluster_{cluster}") for cluster in clusters]
+    
+    results = [
+        {'cluster_id': cluster, 'segment': segment, 'confidence': confidence, 'distance_to_center': distance}
+        for cluster, segment, confidence, distance in zip(clusters, segment_names, confidences, distances)
+    ]
+    
+    return results
+
+
+def _predict_one(record, model):
+    """Fast path for a single record that works on plain arrays instead of DataFrames."""
+    fused = model['fused']
+    
+    continuous, binary = prepare_record_features(record, model['feature_stats'])
+    n_continuous = len(continuous)
+    
+    features = np.array(continuous + binary, dtype=np.float32)
+    # The DataFrame path gets this check from Normalizer.transform
+    if not np.isfinite(features).all():
+        raise ValueError("Input contains NaN or infinity")
+    norm = np.linalg.norm(features[:n_continuous], ord=_NORM_ORDERS[model['normalizer'].norm])
+    if norm:
+        features[:n_continuous] /= norm
+        
+    pca_features = (features - fused['pca_mean']) @ fused['pca_components_t']
+    sq_distances = pca_features @ pca_features - 2 * (pca_features @ fused['cluster_centers_t']) + fused['center_sq_norms']
+    
+    cluster = int(sq_distances.argmin())
+    distance = float(np.sqrt(max(sq_distances[cluster], 0.0)))
+    
+    return {
+        'cluster_id': cluster,
+        'segment': model['cluster_names'].get(str(cluster), f"Cluster_{cluster}"),
+        'confidence': 1.0 / (1.0 + distance),
+        'distance_to_center': distance
+    }
+
+
 def predict_fn(input_data, model):
     """Make predictions."""
     logger.info("Starting prediction")
     
     try:
-        normalizer = model['normalizer']
-        pca_model = model['pca_model']
-        kmeans_model = model['kmeans_model']
-        cluster_names = model['cluster_names']
-        
-        df_continuous, df_binary = prepare_features_for_training(input_data)
-        numerical_features = get_numerical_features()
-        
-        scaled_continuous_features = normalizer.transform(df_continuous)
-        scaled_continuous_df = pd.DataFrame(scaled_continuous_features, columns=numerical_features)
-        
-        processed_df = pd.concat([scaled_continuous_df, df_binary.reset_index(drop=True)], axis=1)
-        pca_features = pca_model.transform(processed_df)
-        cluster_predictions = kmeans_model.predict(pca_features)
-        
-        segment_names = [cluster_names.get(str(cluster), f"Cluster_{cluster}") for cluster in cluster_predictions]
-        
-        distances = kmeans_model.transform(pca_features)
-        min_distances = np.min(distances, axis=1)
-        
-        results = []
-        for cluster, segment, distance in zip(cluster_predictions, segment_names, min_distances):
-            results.append({
-                'cluster_id': int(cluster),
-                'segment': segment,
-                'confidence': float(1.0 / (1.0 + distance)),
-                'distance_to_center': float(distance)
-            })
+        # Rows are only independent of each other with persisted training statistics,
+        # so the single-record fast path and batching are only used then
+        if model['feature_stats'] is None and len(input_data) < MIN_ROWS_WITHOUT_STATS:
+            raise ValueError(f"Model artifact has no feature statistics; at least {MIN_ROWS_WITHOUT_STATS} "
+                             f"rows are required per request, got {len(input_data)}")
+        if model['feature_stats'] is not None and len(input_data) == 1:
+            results = [_predict_one(input_data.iloc[0].to_dict(), model)]
+        elif model['feature_stats'] is not None and BATCH_SIZE > 1 and len(input_data) < BATCH_SIZE:
+            results = _get_batcher(model).submit(input_data)
+        else:
+            results = _predict_records(input_data, model)
             
-        logger.info(f"Predictions completed: {len(results)} samples")
+        logger.info("Predictions completed: %d samples", len(results))
         
         return {
             'predictions': results,
@@ -128,7 +368,7 @@ def predict_fn(input_data, model):
         }
         
     except Exception as e:
-        logger.error(f"Error during prediction: {str(e)}")
+        logger.error("Error during prediction: %s", e)
         raise
 
 
@@ -136,11 +376,11 @@ def output_fn(prediction, accept):
     """Format output."""
     try:
         if accept == 'application/json':
-            return json.dumps(prediction)
+            return _json_dumps(prediction)
         else:
-            logger.warning(f"Unsupported accept type {accept}, defaulting to JSON")
-            return json.dumps(prediction)
+            logger.warning("Unsupported accept type %s, defaulting to JSON", accept)
+            return _json_dumps(prediction)
             
     except Exception as e:
-        logger.error(f"Error formatting output: {str(e)}")
+        logger.error("Error formatting output: %s", e)
         raise
\ No newline at end of file
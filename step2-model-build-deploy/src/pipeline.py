@@ -3,10 +3,12 @@
 SageMaker Pipeline for Customer Segmentation Model
 """
 
+import functools
 import boto3
 import sagemaker
 from sagemaker.sklearn.estimator import SKLearn
 from sagemaker.workflow.parameters import ParameterInteger, ParameterString
+from sagemaker.workflow.functions import Join
 from sagemaker.workflow.pipeline import Pipeline
 from sagemaker.workflow.steps import TrainingStep, CreateModelStep
 from sagemaker.workflow.step_collections import RegisterModel  
@@ -18,6 +20,22 @@ from sagemaker.workflow.lambda_step import LambdaStep
 import time
 
 
+# Value of a metric line printed by train.py; silhouette scores range over [-1, 1]
+METRIC_VALUE_REGEX = "(-?[0-9]+(?:\\.[0-9]+)?)"
+
+
+@functools.lru_cache(maxsize=None)
+def _sagemaker_client(region):
+    """Return a SageMaker client for region, created once per process."""
+    return boto3.client('sagemaker', region_name=region)
+
+
+@functools.lru_cache(maxsize=None)
+def _sagemaker_session(region):
+    """Return a SageMaker session for region, created once per process."""
+    return sagemaker.Session(boto_session=boto3.Session(region_name=region))
+
+
 def load_config(config_file="pipeline_config.yaml"):
     with open(config_file, 'r') as f:
         return yaml.safe_load(f)
@@ -34,7 +52,7 @@ def create_pipeline(
     """Create and return SageMaker Pipeline"""
     
     # Initialize SageMaker session
-    sagemaker_session = sagemaker.Session()
+    sagemaker_session = _sagemaker_session(region)
     
     # Pipeline parameters
     n_clusters_param = ParameterInteger(name="NClusters", default_value=3)
@@ -42,6 +60,8 @@ def create_pipeline(
     data_file_param = ParameterString(name="DataFile", default_value="customer_segmentation_data.csv")
     training_instance_type_param = ParameterString(name="TrainingInstanceType", default_value="ml.m5.large")
     inference_instance_type_param = ParameterString(name="InferenceInstanceType", default_value="ml.t2.medium")
+    # Resolved per execution so the pipeline definition stays stable across upserts
+    execution_id_param = ParameterString(name="ExecutionId", default_value="latest")
     
     # Training step
     sklearn_estimator = SKLearn(
@@ -60,9 +80,9 @@ def create_pipeline(
             "data-file": data_file_param
         },
         metric_definitions=[
-            {"Name": "silhouette_score", "Regex": "Silhouette Score: ([0-9\\.]+)"},
-            {"Name": "calinski_harabasz_score", "Regex": "Calinski-Harabasz Index: ([0-9\\.]+)"},
-            {"Name": "davies_bouldin_score", "Regex": "Davies-Bouldin Index: ([0-9\\.]+)"}
+            {"Name": "silhouette_score", "Regex": f"Silhouette Score: {METRIC_VALUE_REGEX}"},
+            {"Name": "calinski_harabasz_score", "Regex": f"Calinski-Harabasz Index: {METRIC_VALUE_REGEX}"},
+            {"Name": "davies_bouldin_score", "Regex": f"Davies-Bouldin Index: {METRIC_VALUE_REGEX}"}
         ]
     )
     
@@ -122,8 +142,8 @@ def create_pipeline(
         lambda_func = deploy_lambda,
         inputs      = {
             "model_name"           : create_model_step.properties.ModelName,
-            "endpoint_config_name" : f"{project_name}-endpoint-config-{environment}-{int(time.time())}",
-            "endpoint_name"        : f"{project_name}-endpoint-{environment}-{int(time.time())}",
+            "endpoint_config_name" : Join(on="-", values=[f"{project_name}-endpoint-config-{environment}", execution_id_param]),
+            "endpoint_name"        : Join(on="-", values=[f"{project_name}-endpoint-{environment}", execution_id_param]),
             "instance_type"        : inference_instance_type_param,
             "instance_count"       : 1,
         }
@@ -136,7 +156,8 @@ def create_pipeline(
             n_components_param,
             data_file_param,
             training_instance_type_param,
-            inference_instance_type_param
+            inference_instance_type_param,
+            execution_id_param
         ],
         steps=[
             training_step,
@@ -189,11 +210,14 @@ def run_pipeline(
     if not pipeline_name:
         pipeline_name = f"{project_name}-pipeline-{environment}"
     
-    sm_client = boto3.client('sagemaker')
+    # Timestamp endpoint names per execution
+    parameters = {'ExecutionId': str(int(time.time())), **(parameters or {})}
+    
+    sm_client = _sagemaker_client(region)
     response = sm_client.start_pipeline_execution(
     PipelineName=pipeline_name,
     PipelineParameters=[
-        {'Name': k, 'Value': str(v)} for k, v in (parameters or {}).items()
+        {'Name': k, 'Value': str(v)} for k, v in parameters.items()
     ])
     execution_arn = response['PipelineExecutionArn']
     print(f"Execution ARN: {execution_arn}")
@@ -3,105 +3,191 @@ Preprocessing functions for customer segmentation model.
 Extracted from the original notebook for reusability.
 """
 
+from bisect import bisect_left
+
 import pandas as pd
 import numpy as np
 
 
-def calculate_derived_features(df):
+QUARTILE_LEVELS = [0.0, 0.25, 0.5, 0.75, 1.0]
+
+# Quartile labels kept after one-hot encoding (Q1_Low is dropped to avoid multicollinearity)
+QUARTILE_DUMMY_LABELS = ['Q2_Medium_Low', 'Q3_Medium_High', 'Q4_High']
+
+
+def _quartile_dummies(values, edges, prefix):
+    """One-hot encode values into quartiles 2-4 given the five quartile edges."""
+    # Bins are right-closed like pd.qcut: (edges[i], edges[i + 1]]
+    bins = np.digitize(values, edges[1:-1], right=True)
+    
+    # Dense int8 one-hot in a single buffer, dropping the first quartile
+    one_hot = (bins[:, np.newaxis] == np.arange(1, len(QUARTILE_DUMMY_LABELS) + 1)).astype(np.int8)
+    return {
+        f'{prefix}_{label}': one_hot[:, i]
+        for i, label in enumerate(QUARTILE_DUMMY_LABELS)
+    }
+
+
+def compute_feature_stats(df):
+    """
+    Compute the dataset statistics that derived features depend on.
+
+    These are computed once on the training data and persisted with the model
+    so inference uses the same quartile edges and averages as training,
+    independent of the request batch size.
+
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        Raw customer data with columns: Age, Income, Purchases, Gender
+
+    Returns:
+    --------
+    dict
+        Quartile edges, maximum purchases and gender averages
+    """
+    income = df['Income'].to_numpy()
+    purchases = df['Purchases'].to_numpy()
+    gender = df['Gender'].to_numpy()
+    is_male = gender == 'Male'
+    is_female = gender == 'Female'
+
+    return {
+        'income_edges': np.quantile(income, QUARTILE_LEVELS),
+        'purchase_edges': np.quantile(purchases, QUARTILE_LEVELS),
+        'max_purchases': purchases.max(),
+        'male_avg_income': income[is_male].mean(),
+        'female_avg_income': income[is_female].mean(),
+        'male_avg_purchases': purchases[is_male].mean(),
+        'female_avg_purchases': purchases[is_female].mean(),
+    }
+
+
+def calculate_derived_features(df, stats=None):
     """
     Calculate specific derived features for customer segmentation.
 
+    The input columns are extracted once as NumPy arrays and every derived
+    feature is computed with vectorized array operations, so the output frame
+    is assembled in a single allocation instead of column by column.
+
     Parameters:
     -----------
     df : pandas.DataFrame
         DataFrame with columns: Customer_ID, Age, Income, Purchases, Gender
+    stats : dict, optional
+        Statistics from compute_feature_stats on the training data. When
+        omitted they are computed from df itself.
 
     Returns:
     --------
     pandas.DataFrame
-        DataFrame with original columns plus derived features
+        DataFrame with Age, Income, Purchases plus derived features
     """
-    # Create a copy
-    df_derived = df.copy()
+    age = df['Age'].to_numpy()
+    income = df['Income'].to_numpy()
+    purchases = df['Purchases'].to_numpy()
+    is_male = df['Gender'].to_numpy() == 'Male'
+
+    if stats is None:
+        stats = compute_feature_stats(df)
+
+    features = {'Age': age, 'Income': income, 'Purchases': purchases}
 
     # AGE-BASED DERIVED FEATURES
-    df_derived['Is_Young_Adult'] = (df_derived['Age'] <= 30).astype(int)
-    df_derived['Is_Middle_Aged'] = ((df_derived['Age'] > 30) & (df_derived['Age'] <= 50)).astype(int)
-    df_derived['Is_Senior'] = (df_derived['Age'] > 50).astype(int)
+    features['Is_Young_Adult'] = (age <= 30).astype(np.int8)
+    features['Is_Middle_Aged'] = ((age > 30) & (age <= 50)).astype(np.int8)
+    features['Is_Senior'] = (age > 50).astype(np.int8)
 
     # GENDER-BASED DERIVED FEATURES
-    df_derived['IS_MALE'] = (df_derived['Gender'] == 'Male').astype(int)
+    features['IS_MALE'] = is_male.astype(np.int8)
 
     # INCOME-BASED DERIVED FEATURES
-    income_quartile_temp = pd.qcut(
-        df_derived['Income'],
-        q=4,
-        labels=['Q1_Low', 'Q2_Medium_Low', 'Q3_Medium_High', 'Q4_High']
-    )
-
-    # One-hot encode Income_Quartile (drop_first=True to avoid multicollinearity)
-    income_quartile_dummies = pd.get_dummies(income_quartile_temp, prefix='Income_Quartile', drop_first=True, dtype=int)
-    df_derived = pd.concat([df_derived, income_quartile_dummies], axis=1)
+    features.update(_quartile_dummies(income, stats['income_edges'], 'Income_Quartile'))
 
     # Income_Age_Ratio: Income divided by age
-    df_derived['Income_Age_Ratio'] = df_derived['Income'] / df_derived['Age']
+    features['Income_Age_Ratio'] = income / age
 
     # PURCHASE-BASED DERIVED FEATURES
-    purchase_quartile_temp = pd.qcut(
-        df_derived['Purchases'],
-        q=4,
-        labels=['Q1_Low', 'Q2_Medium_Low', 'Q3_Medium_High', 'Q4_High']
-    )
-
-    # One-hot encode Purchase_Quartile (drop_first=True to avoid multicollinearity)
-    purchase_quartile_dummies = pd.get_dummies(purchase_quartile_temp, prefix='Purchase_Quartile', drop_first=True, dtype=int)
-    df_derived = pd.concat([df_derived, purchase_quartile_dummies], axis=1)
+    features.update(_quartile_dummies(purchases, stats['purchase_edges'], 'Purchase_Quartile'))
 
     # Purchase_Intensity: Normalized purchase frequency (0-1 scale)
-    max_purchases = df_derived['Purchases'].max()
-    df_derived['Purchase_Intensity'] = df_derived['Purchases'] / max_purchases
+    features['Purchase_Intensity'] = purchases / stats['max_purchases']
 
     # INTERACTION/RATIO FEATURES
-    df_derived['Age_Income_Ratio'] = df_derived['Age'] / (df_derived['Income'] / 1000)
-    df_derived['Purchase_Age_Ratio'] = df_derived['Purchases'] / df_derived['Age']
+    features['Age_Income_Ratio'] = age / (income / 1000)
+    features['Purchase_Age_Ratio'] = purchases / age
 
     # GENDER-RELATIVE FEATURES
-    male_avg_income = df_derived[df_derived['Gender'] == 'Male']['Income'].mean()
-    female_avg_income = df_derived[df_derived['Gender'] == 'Female']['Income'].mean()
-
-    male_avg_purchases = df_derived[df_derived['Gender'] == 'Male']['Purchases'].mean()
-    female_avg_purchases = df_derived[df_derived['Gender'] == 'Female']['Purchases'].mean()
-
     # Income_Relative_To_Gender_Avg: Income relative to same-gender average
-    df_derived['Income_Relative_To_Gender_Avg'] = np.where(
-        df_derived['Gender'] == 'Male',
-        df_derived['Income'] / male_avg_income,
-        df_derived['Income'] / female_avg_income
-    )
+    features['Income_Relative_To_Gender_Avg'] = income / np.where(is_male, stats['male_avg_income'], stats['female_avg_income'])
 
     # Purchases_Relative_To_Gender_Avg: Purchases relative to same-gender average
-    df_derived['Purchases_Relative_To_Gender_Avg'] = np.where(
-        df_derived['Gender'] == 'Male',
-        df_derived['Purchases'] / male_avg_purchases,
-        df_derived['Purchases'] / female_avg_purchases
-    )
-
-    # Drop original categorical columns
-    df_derived = df_derived.drop(['Gender', 'Customer_ID'], axis=1)
-    
-    return df_derived
+    features['Purchases_Relative_To_Gender_Avg'] = purchases / np.where(is_male, stats['male_avg_purchases'], stats['female_avg_purchases'])
+
+    return pd.DataFrame(features, index=df.index, copy=False)
+
+
+# Numerical features used for scaling, in model input order
+NUMERICAL_FEATURES = (
+    'Age', 'Income', 'Purchases', 'Income_Age_Ratio', 'Purchase_Intensity',
+    'Age_Income_Ratio', 'Purchase_Age_Ratio', 'Income_Relative_To_Gender_Avg',
+    'Purchases_Relative_To_Gender_Avg'
+)
 
 
 def get_numerical_features():
-    """Return list of numerical features used for scaling."""
-    return [
-        'Age', 'Income', 'Purchases', 'Income_Age_Ratio', 'Purchase_Intensity',
-        'Age_Income_Ratio', 'Purchase_Age_Ratio', 'Income_Relative_To_Gender_Avg',
-        'Purchases_Relative_To_Gender_Avg'
-    ]
+    """Return tuple of numerical features used for scaling."""
+    return NUMERICAL_FEATURES
+
+
+def get_feature_positions(columns):
+    """
+    Locate the numerical and binary features within the derived feature columns.
+    
+    The positions are stored with the training statistics so inference can
+    split derived features positionally instead of by column name.
+    
+    Parameters:
+    -----------
+    columns : pandas.Index
+        Columns returned by calculate_derived_features
+        
+    Returns:
+    --------
+    dict
+        numerical_idx and binary_idx positional index arrays
+    """
+    numerical = set(NUMERICAL_FEATURES)
+    return {
+        'numerical_idx': np.array([columns.get_loc(column) for column in NUMERICAL_FEATURES]),
+        'binary_idx': np.array([i for i, column in enumerate(columns) if column not in numerical])
+    }
 
 
-def prepare_features_for_training(df):
+def split_features(df_derived, stats=None):
+    """
+    Separate derived features into continuous and binary features.
+    
+    Parameters:
+    -----------
+    df_derived : pandas.DataFrame
+        Output of calculate_derived_features
+    stats : dict, optional
+        Training statistics; when they include feature positions the split is positional
+        
+    Returns:
+    --------
+    tuple: (continuous_features_df, binary_features_df)
+    """
+    if stats is not None and 'numerical_idx' in stats:
+        return df_derived.iloc[:, stats['numerical_idx']], df_derived.iloc[:, stats['binary_idx']]
+    
+    numerical_features = list(NUMERICAL_FEATURES)
+    return df_derived[numerical_features], df_derived.drop(numerical_features, axis=1)
+
+
+def prepare_features_for_training(df, stats=None):
     """
     Full preprocessing pipeline for training.
     
@@ -109,22 +195,65 @@ def prepare_features_for_training(df):
     -----------
     df : pandas.DataFrame
         Raw customer data
+    stats : dict, optional
+        Training statistics from compute_feature_stats
         
     Returns:
     --------
     tuple: (continuous_features_df, binary_features_df)
     """
     # Apply feature engineering
-    df_derived = calculate_derived_features(df)
-    
-    # Get feature lists
-    numerical_features = get_numerical_features()
+    df_derived = calculate_derived_features(df, stats)
     
     # Separate continuous and binary features
-    df_continuous = df_derived[numerical_features]
-    df_binary = df_derived.drop(numerical_features, axis=1)
+    return split_features(df_derived, stats)
+
+
+def prepare_record_features(record, stats):
+    """
+    Scalar preprocessing for a single customer record.
+    
+    Computes the same features as prepare_features_for_training with plain
+    Python arithmetic, avoiding DataFrame construction for one-row requests.
+    
+    Parameters:
+    -----------
+    record : dict
+        Customer record with keys: Age, Income, Purchases, Gender
+    stats : dict
+        Training statistics from compute_feature_stats
+        
+    Returns:
+    --------
+    tuple: (continuous_features_list, binary_features_list)
+        Ordered like the columns returned by prepare_features_for_training
+    """
+    age = record['Age']
+    income = record['Income']
+    purchases = record['Purchases']
+    is_male = record['Gender'] == 'Male'
+    
+    # Right-closed quartile bins, matching _quartile_dummies
+    income_quartile = bisect_left(stats['income_edges'][1:-1], income)
+    purchase_quartile = bisect_left(stats['purchase_edges'][1:-1], purchases)
+    
+    continuous = [
+        age,
+        income,
+        purchases,
+        income / age,
+        purchases / stats['max_purchases'],
+        age / (income / 1000),
+        purchases / age,
+        income / (stats['male_avg_income'] if is_male else stats['female_avg_income']),
+        purchases / (stats['male_avg_purchases'] if is_male else stats['female_avg_purchases'])
+    ]
+    
+    binary = [int(age <= 30), int(30 < age <= 50), int(age > 50), int(is_male)]
+    binary += [int(income_quartile == level) for level in range(1, len(QUARTILE_DUMMY_LABELS) + 1)]
+    binary += [int(purchase_quartile == level) for level in range(1, len(QUARTILE_DUMMY_LABELS) + 1)]
     
-    return df_continuous, df_binary
+    return continuous, binary
 
 
 def get_cluster_names():
@@ -13,7 +13,10 @@ from sklearn.cluster import KMeans
 from sklearn.metrics import silhouette_score, calinski_harabasz_score, davies_bouldin_score
 import json
 import shutil
-from preprocessing import prepare_features_for_training, get_numerical_features, get_cluster_names
+from preprocessing import (
+    calculate_derived_features, compute_feature_stats, get_feature_positions, split_features,
+    get_numerical_features, get_cluster_names
+)
 from config import DEFAULT_DATA_FILE, DEFAULT_N_CLUSTERS, DEFAULT_N_COMPONENTS
 
 
@@ -29,13 +32,18 @@ def train_model(args):
     df = pd.read_csv(train_file)
     print(f"Loaded {len(df)} records")
     
-    # Prepare features
-    df_continuous, df_binary = prepare_features_for_training(df)
+    # Compute training statistics reused at inference time
+    feature_stats = compute_feature_stats(df)
+    
+    # Prepare features, recording where each feature group sits for inference
+    df_derived = calculate_derived_features(df, feature_stats)
+    feature_stats.update(get_feature_positions(df_derived.columns))
+    df_continuous, df_binary = split_features(df_derived, feature_stats)
     
     # Normalize continuous features
     normalizer = Normalizer()
     scaled_continuous_features = normalizer.fit_transform(df_continuous)
-    scaled_continuous_df = pd.DataFrame(scaled_continuous_features, columns=get_numerical_features())
+    scaled_continuous_df = pd.DataFrame(scaled_continuous_features, columns=list(get_numerical_features()))
     
     # Combine features
     processed_df = pd.concat([scaled_continuous_df, df_binary.reset_index(drop=True)], axis=1)
@@ -67,6 +75,7 @@ def train_model(args):
     joblib.dump(normalizer, os.path.join(args.model_dir, 'normalizer.pkl'))
     joblib.dump(pca, os.path.join(args.model_dir, 'pca_model.pkl'))
     joblib.dump(kmeans, os.path.join(args.model_dir, 'kmeans_model.pkl'))
+    joblib.dump(feature_stats, os.path.join(args.model_dir, 'feature_stats.pkl'))
     
     # Save cluster names
     with open(os.path.join(args.model_dir, 'cluster_names.json'), 'w') as f:
@@ -79,7 +88,7 @@ def train_model(args):
         'silhouette_score': silhouette_avg,
         'calinski_harabasz_score': calinski_harabasz,
         'davies_bouldin_score': davies_bouldin,
-        'feature_names': get_numerical_features(),
+        'feature_names': list(get_numerical_features()),
         'model_version': '1.0'
     }
     
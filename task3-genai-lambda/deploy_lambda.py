@@ -1,31 +1,69 @@
 """Deploy Bedrock Lambda function using boto3."""
 
 import argparse
-import io
+import compileall
 import pathlib
+import shutil
+import subprocess
+import sys
+import tempfile
 import zipfile
 import boto3
 
 ROOT_DIR = pathlib.Path(__file__).resolve().parent
 SRC_DIR = ROOT_DIR / "src"
+# botocore service models the handler needs; endpoint/partition JSON at the data root is always kept
+SDK_SERVICES = {"bedrock-runtime", "sts", "apigatewaymanagementapi"}
+# Python version of the Lambda runtime set in deploy()
+LAMBDA_PYTHON = "3.12"
 
 
-def _build_zip(src_dir: pathlib.Path) -> bytes:
-    """Return ZIP payload containing all files under src_dir."""
-    buffer = io.BytesIO()
-    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-        for file_path in src_dir.rglob("*"):
-            if file_path.is_file():
-                zf.write(file_path, file_path.relative_to(src_dir).as_posix())
-    return buffer.getvalue()
+def _install_sdk(target_dir: pathlib.Path) -> None:
+    """Install boto3 into target_dir, keeping only the botocore service models in SDK_SERVICES."""
+    print("Installing boto3 for bundling...")
+    subprocess.run(
+        [sys.executable, "-m", "pip", "install", "--quiet", "--target", str(target_dir),
+         "--python-version", LAMBDA_PYTHON, "--only-binary=:all:", "--no-compile", "boto3"],
+        check=True)
+    for path in (target_dir / "botocore" / "data").iterdir():
+        if path.is_dir() and path.name not in SDK_SERVICES:
+            shutil.rmtree(path)
+    # The Lambda filesystem is read-only, so ship bytecode rather than compiling on every cold start.
+    # Bytecode from any other interpreter version would be ignored by the runtime.
+    if f"{sys.version_info.major}.{sys.version_info.minor}" == LAMBDA_PYTHON:
+        compileall.compile_dir(str(target_dir), quiet=1)
+    else:
+        print(f"Warning: skipping bytecode precompilation, run with Python {LAMBDA_PYTHON} to include it")
+
+
+def _build_zip(src_dir: pathlib.Path, zip_path: pathlib.Path, sdk_dir: pathlib.Path = None) -> None:
+    """Write ZIP archive containing all files under src_dir (and sdk_dir, if given) to zip_path."""
+    # Fastest compression level: the bundle is small, upload dominates
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        for root in (src_dir, sdk_dir) if sdk_dir else (src_dir,):
+            for file_path in root.rglob("*"):
+                if file_path.is_file():
+                    zf.write(file_path, file_path.relative_to(root).as_posix())
+
+
+def _upload_code(zip_path: pathlib.Path, function_name: str, region: str = None,
+                 s3_bucket: str = None, s3_key: str = None) -> dict:
+    """Return Lambda code location, uploading the ZIP to S3 when a bucket is given."""
+    if not s3_bucket:
+        return {"ZipFile": zip_path.read_bytes()}
+
+    s3_key = s3_key or f"lambda/{function_name}.zip"
+    print(f"Uploading code to s3://{s3_bucket}/{s3_key}...")
+    boto3.client("s3", region_name=region).upload_file(str(zip_path), s3_bucket, s3_key)
+    return {"S3Bucket": s3_bucket, "S3Key": s3_key}
 
 
 def deploy(function_name: str, role_arn: str, model_id: str, 
           memory: int = 512, timeout: int = 15, region: str = None,
-          update_if_exists: bool = False):
+          update_if_exists: bool = False, s3_bucket: str = None, s3_key: str = None,
+          bundle_sdk: bool = False):
     """Create or update Lambda function."""
     client = boto3.client("lambda", region_name=region)
-    zip_payload = _build_zip(SRC_DIR)
     env_vars = {"MODEL_ID": model_id}
     
     try:
@@ -34,23 +72,33 @@ def deploy(function_name: str, role_arn: str, model_id: str,
     except client.exceptions.ResourceNotFoundException:
         exists = False
 
-    if exists and update_if_exists:
+    if exists and not update_if_exists:
+        print(f"Function '{function_name}' exists. Use --update-if-exists to update.")
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        zip_path = pathlib.Path(tmp_dir) / f"{function_name}.zip"
+        sdk_dir = None
+        if bundle_sdk:
+            sdk_dir = pathlib.Path(tmp_dir) / "sdk"
+            _install_sdk(sdk_dir)
+        _build_zip(SRC_DIR, zip_path, sdk_dir)
+        code = _upload_code(zip_path, function_name, region, s3_bucket, s3_key)
+
+    if exists:
         print(f"Updating '{function_name}'...")
-        client.update_function_code(FunctionName=function_name, ZipFile=zip_payload, Publish=True)
+        client.update_function_code(FunctionName=function_name, Publish=True, **code)
         client.update_function_configuration(
             FunctionName=function_name, Environment={"Variables": env_vars},
             MemorySize=memory, Timeout=timeout)
-    elif not exists:
+    else:
         print(f"Creating '{function_name}'...")
         client.create_function(
-            FunctionName=function_name, Runtime="python3.12", Role=role_arn,
-            Handler="lambda_handler.lambda_handler", Code={"ZipFile": zip_payload},
+            FunctionName=function_name, Runtime=f"python{LAMBDA_PYTHON}", Role=role_arn,
+            Handler="lambda_handler.lambda_handler", Code=code,
             Description="Generative AI inference via Amazon Bedrock",
             Timeout=timeout, MemorySize=memory, Publish=True,
             Environment={"Variables": env_vars})
-    else:
-        print(f"Function '{function_name}' exists. Use --update-if-exists to update.")
-        return
     
     print("Completed")
 
@@ -64,10 +112,16 @@ def main():
     parser.add_argument("--timeout", type=int, default=15)
     parser.add_argument("--region")
     parser.add_argument("--update-if-exists", action="store_true")
+    parser.add_argument("--s3-bucket", help="Upload the code ZIP here instead of sending it inline")
+    parser.add_argument("--s3-key", help="Object key for the code ZIP (default: lambda/<function-name>.zip)")
+    parser.add_argument("--bundle-sdk", action="store_true",
+                        help="Bundle boto3 trimmed to the bedrock-runtime, sts and apigatewaymanagementapi models "
+                             "instead of using the runtime's copy")
     
     args = parser.parse_args()
     deploy(args.function_name, args.role_arn, args.model_id, 
-           args.memory, args.timeout, args.region, args.update_if_exists)
+           args.memory, args.timeout, args.region, args.update_if_exists,
+           args.s3_bucket, args.s3_key, args.bundle_sdk)
 
 
 if __name__ == "__main__":
@@ -1,57 +1,365 @@
 """AWS Lambda handler for Amazon Bedrock text generation.
 
-Usage: Set MODEL_ID, MAX_TOKENS, TEMPERATURE env vars. Send {"text": "prompt"} in event body.
-Returns {"completion": "generated text"} or error response.
+Usage: Set MODEL_ID, MAX_TOKENS, TEMPERATURE (and optionally MAX_POOL_CONNECTIONS, DIRECT_HTTP, CACHE_SIZE,
+BEDROCK_ENDPOINT_URL, MAX_BATCH) env vars.
+Send {"text": "prompt"} in event body, or {"texts": ["prompt", ...]} to run several prompts in parallel.
+Returns {"completion": "generated text"} ({"completions": [...]} for batches) or error response.
+Over an API Gateway WebSocket, a single prompt's completion is streamed to the connection as
+{"completion": "..."} chunk messages instead.
 """
 
+from __future__ import annotations
+
 import json
+import logging
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from urllib.parse import quote
+
 import boto3
+import urllib3
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+
+try:
+    import orjson
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+    _JSONDecodeError = orjson.JSONDecodeError
+except ImportError:  # Fall back to ujson, then the stdlib, when orjson is not bundled
+    orjson = None
+    try:
+        import ujson
+    except ImportError:
+        ujson = None
+
+    if ujson is not None:
+        _loads = ujson.loads
+        _JSONDecodeError = ujson.JSONDecodeError
+
+        def _dumps(obj) -> bytes:
+            return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False).encode()
+    else:
+        _loads = json.loads
+        _JSONDecodeError = json.JSONDecodeError
+        # One compact encoder reused across calls, matching orjson's output
+        _encode = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).encode
+
+        def _dumps(obj) -> bytes:
+            return _encode(obj).encode()
 
-_BEDROCK = boto3.client("bedrock-runtime")
+try:  # HTTP/2 needs both httpx and h2; fall back to the urllib3 pool when either is missing
+    import h2  # noqa: F401
+    import httpx
+except ImportError:
+    httpx = None
+
+_LOGGER = logging.getLogger(__name__)
+
+# Keep-alive pooled connections and bounded adaptive retries, reused across warm invocations
+_CONFIG = Config(
+    region_name=os.environ.get("AWS_REGION"),
+    retries={"mode": "adaptive", "max_attempts": 2},
+    max_pool_connections=int(os.environ.get("MAX_POOL_CONNECTIONS", "10")),
+    tcp_keepalive=True,
+)
+_SESSION = boto3.Session()
 _MODEL_ID = os.environ.get("MODEL_ID", "anthropic.claude-v2")
 _MAX_TOKENS = int(os.environ.get("MAX_TOKENS", "400"))
 _TEMPERATURE = float(os.environ.get("TEMPERATURE", "0.7"))
+_CACHE_SIZE = int(os.environ.get("CACHE_SIZE", "128"))
+# Caps the Bedrock calls one request can fan out to within the function timeout
+_MAX_BATCH = int(os.environ.get("MAX_BATCH", "10"))
+
+# Request body template is fixed at import; only the encoded prompt is formatted in
+_REQUEST_TEMPLATE = b'{"prompt":%b,' + _dumps({
+    "max_tokens_to_sample": _MAX_TOKENS,
+    "temperature": _TEMPERATURE,
+    "stop_sequences": ["\n\nHuman:"],
+})[1:].replace(b"%", b"%%")
+
+# Signed POSTs over a persistent pool skip botocore's per-call event and serializer
+# pipeline; set DIRECT_HTTP=0 to go through the boto3 client instead
+_CREDENTIALS = _SESSION.get_credentials()
+_DIRECT_HTTP = os.environ.get("DIRECT_HTTP", "1") != "0" and _CREDENTIALS is not None
+_REGION = _CONFIG.region_name or _SESSION.region_name
+# Endpoint is fixed at import; the China partition is the only one with a different DNS suffix
+_ENDPOINT_URL = os.environ.get("BEDROCK_ENDPOINT_URL") or (
+    f"https://bedrock-runtime.{_REGION}.amazonaws.com{'.cn' if _REGION.startswith('cn-') else ''}"
+)
+_INVOKE_URL = f"{_ENDPOINT_URL.rstrip('/')}/model/{quote(_MODEL_ID, safe='')}/invoke"
+_INVOKE_HEADERS = {"Content-Type": "application/json", "Accept": "application/json"}
+# Same attempt budget and retryable responses as the client's botocore retry config, where
+# max_attempts counts retries after the first attempt
+_MAX_ATTEMPTS = _CONFIG.retries.get("total_max_attempts") or _CONFIG.retries.get("max_attempts", 2) + 1
+_MAX_BACKOFF = 20
+_RETRYABLE_STATUS = frozenset((429, 500, 502, 503, 504))
+_RETRYABLE_CODES = frozenset(("ThrottlingException", "ServiceUnavailableException", "ModelNotReadyException"))
+if httpx is not None:
+    # HTTP/2 multiplexes concurrent batch calls over one TLS connection
+    _HTTP = httpx.Client(
+        transport=httpx.HTTPTransport(
+            http2=True,
+            retries=_MAX_ATTEMPTS - 1,  # connect failures only, as with urllib3's default
+            limits=httpx.Limits(max_connections=_CONFIG.max_pool_connections, keepalive_expiry=120),
+        ),
+        timeout=httpx.Timeout(_CONFIG.read_timeout, connect=_CONFIG.connect_timeout),
+    )
+else:
+    _HTTP = urllib3.PoolManager(
+        num_pools=1,
+        maxsize=_CONFIG.max_pool_connections,
+        headers={"Connection": "keep-alive"},
+        timeout=urllib3.Timeout(connect=_CONFIG.connect_timeout, read=_CONFIG.read_timeout),
+    )
+
+# boto3 client creation loads the service model, so it is deferred to first use on
+# on-demand cold starts; provisioned concurrency initializes ahead of traffic instead
+_BEDROCK = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def _client():
+    """Return the bedrock-runtime client, creating it on first use."""
+    global _BEDROCK
+    if _BEDROCK is None:
+        # Batch workers may race here, and client creation on a shared session is not thread-safe
+        with _CLIENT_LOCK:
+            if _BEDROCK is None:
+                _BEDROCK = _SESSION.client("bedrock-runtime", endpoint_url=_ENDPOINT_URL, config=_CONFIG)
+    return _BEDROCK
 
 
-def _response(status_code: int, body: dict) -> dict:
+if os.environ.get("AWS_LAMBDA_INITIALIZATION_TYPE") == "provisioned-concurrency":
+    _client()
+
+# One batch worker per pooled connection, so parallel calls never wait on the pool
+_EXECUTOR = ThreadPoolExecutor(max_workers=_CONFIG.max_pool_connections)
+
+_HEADERS = {"Content-Type": "application/json"}
+
+
+def _err(status_code: int, message: str) -> dict:
     return {
         "statusCode": status_code,
-        "headers": {"Content-Type": "application/json"},
-        "body": json.dumps(body),
+        "headers": _HEADERS,
+        "body": (b'{"error":' + _dumps(message) + b"}").decode(),
     }
 
 
-def lambda_handler(event: dict, context) -> dict:
-    # Parse request body
-    if isinstance(event.get("body"), str):
-        try:
-            payload = json.loads(event["body"] or "{}")
-        except json.JSONDecodeError:
-            return _response(400, {"error": "Invalid JSON"})
-    else:
-        payload = event.get("body") or event
-
-    user_text = (payload or {}).get("text", "").strip()
-    if not user_text:
-        return _response(400, {"error": "'text' field required"})
-
-    # Call Bedrock
-    request = {
-        "prompt": f"Human: {user_text}\n\nAssistant:",
-        "max_tokens_to_sample": _MAX_TOKENS,
-        "temperature": _TEMPERATURE,
-        "stop_sequences": ["\n\nHuman:"],
-    }
+# Error responses are built once; the full error goes to the log instead of the body
+_ERR_RESPONSES = {
+    code: _err(status_code, code)
+    for code, status_code in (
+        ("ValidationException", 400),
+        ("AccessDeniedException", 403),
+        ("ResourceNotFoundException", 404),
+        ("ModelTimeoutException", 408),
+        ("GoneException", 410),
+        ("ModelErrorException", 424),
+        ("ThrottlingException", 429),
+        ("ServiceQuotaExceededException", 429),
+        ("ModelNotReadyException", 429),
+        ("ServiceUnavailableException", 503),
+    )
+}
+_WS_OK = {"statusCode": 200}
+_WS_LIFECYCLE_ROUTES = frozenset(("$connect", "$disconnect"))
+_ERR_INVALID_JSON = _err(400, "Invalid JSON")
+_ERR_TEXT_REQUIRED = _err(400, "'text' field required")
+_ERR_TEXTS_REQUIRED = _err(400, "'texts' must be a list of non-empty strings")
+_ERR_BATCH_TOO_LARGE = _err(400, f"'texts' may contain at most {_MAX_BATCH} prompts")
+_ERR_500 = _err(500, "Model invocation failed")
+_ERR_503 = _err(503, "Bedrock endpoint unreachable")
+# botocore client and direct urllib3 transport failures
+_CONNECTION_ERRORS = (BotoConnectionError, HTTPClientError, Urllib3HTTPError)
+if httpx is not None:
+    _CONNECTION_ERRORS += (httpx.TransportError,)
+
+
+def _build_request(user_text: str) -> bytes:
+    """Return the Bedrock request body for user_text."""
+    return _REQUEST_TEMPLATE % _dumps(f"Human: {user_text}\n\nAssistant:")
+
 
+def _post(body: bytes, headers: dict):
+    """POST body to the invoke URL and return the status, headers and raw body of the response."""
+    if httpx is not None:
+        response = _HTTP.post(_INVOKE_URL, content=body, headers=headers)
+        return response.status_code, response.headers, response.content
+    response = _HTTP.urlopen("POST", _INVOKE_URL, body=body, headers=headers)
+    return response.status, response.headers, response.data
+
+
+def _error_message(data: bytes) -> str:
+    """Return the message from an error response body, or "" if it is not a JSON object."""
     try:
-        response = _BEDROCK.invoke_model(
+        message = _loads(data).get("message", "") if data else ""
+    except (_JSONDecodeError, AttributeError):
+        return ""
+    return message if isinstance(message, str) else ""
+
+
+def _invoke(body: bytes) -> bytes:
+    """Invoke the model with a request body and return the raw response body."""
+    if not _DIRECT_HTTP:
+        response = _client().invoke_model(
             modelId=_MODEL_ID,
             contentType="application/json",
             accept="application/json",
-            body=json.dumps(request),
+            body=body,
+        )
+        return response["body"].read()
+
+    for attempt in range(_MAX_ATTEMPTS):
+        request = AWSRequest(method="POST", url=_INVOKE_URL, data=body, headers=_INVOKE_HEADERS)
+        SigV4Auth(_CREDENTIALS.get_frozen_credentials(), "bedrock", _REGION).add_auth(request)
+        status, headers, data = _post(body, dict(request.headers))
+        if status == 200:
+            return data
+        code = headers.get("x-amzn-ErrorType", "").split(":")[0] or str(status)
+        if attempt + 1 < _MAX_ATTEMPTS and (status in _RETRYABLE_STATUS or code in _RETRYABLE_CODES):
+            # Full-jitter exponential backoff, as in botocore's standard retry mode
+            time.sleep(random.random() * min(_MAX_BACKOFF, 2 ** attempt))
+            continue
+        # Surface errors the same way the boto3 client does
+        raise ClientError(
+            {"Error": {"Code": code, "Message": _error_message(data)}, "ResponseMetadata": {"HTTPStatusCode": status}},
+            "InvokeModel",
         )
-        completion = json.loads(response["body"].read()).get("completion")
-        return _response(200, {"completion": completion})
-    except Exception as e:
-        return _response(500, {"error": str(e)})
\ No newline at end of file
+
+
+def _read_completion(raw: bytes):
+    """Return the completion from a raw invoke response body."""
+    # Parse the raw UTF-8 bytes directly, without decoding to str first
+    return _loads(raw).get("completion")
+
+
+@lru_cache(maxsize=None)
+def _ws_client(endpoint_url: str):
+    """Return an API Gateway management client for a WebSocket API stage."""
+    return _SESSION.client("apigatewaymanagementapi", endpoint_url=endpoint_url, config=_CONFIG)
+
+
+def _stream_to_connection(user_text: str, request_context: dict) -> None:
+    """Post the completion for user_text to a WebSocket connection as Bedrock generates it."""
+    ws = _ws_client(f"https://{request_context['domainName']}/{request_context['stage']}")
+    response = _client().invoke_model_with_response_stream(
+        modelId=_MODEL_ID,
+        contentType="application/json",
+        accept="application/json",
+        body=_build_request(user_text),
+    )
+    for event in response["body"]:
+        chunk = event.get("chunk")
+        completion = _read_completion(chunk["bytes"]) if chunk else None
+        if completion:
+            ws.post_to_connection(
+                ConnectionId=request_context["connectionId"],
+                Data=b'{"completion":' + _dumps(completion) + b"}",
+            )
+
+
+def _parse_body(event: dict):
+    """Return the request payload from event, or None if the body is not valid JSON."""
+    body = event.get("body")
+    if isinstance(body, str):
+        if not body:
+            return {}
+        if body[0].isspace():
+            body = body.lstrip()
+        # Junk that cannot be an object or array fails fast, without raising in the parser
+        if not body or body[0] not in "{[":
+            return None
+        try:
+            return _loads(body) or {}
+        except _JSONDecodeError:
+            return None
+    return body or event
+
+
+def _clean_text(text) -> str | None:
+    """Return text trimmed, or None if it is not a string or is blank."""
+    if not isinstance(text, str) or not text:
+        return None
+    # Only copy the prompt when there is whitespace to trim
+    if text[0].isspace() or text[-1].isspace():
+        text = text.strip()
+    return text or None
+
+
+def _extract_text(payload) -> str | None:
+    """Return the trimmed prompt text from payload, or None if it is missing or blank."""
+    return _clean_text(payload.get("text")) if isinstance(payload, dict) else None
+
+
+def _extract_texts(payload: dict) -> list | None:
+    """Return the trimmed batch prompts from payload, or None if any is missing or blank."""
+    texts = payload["texts"]
+    if not isinstance(texts, list) or not texts:
+        return None
+    cleaned = [_clean_text(text) for text in texts]
+    return None if None in cleaned else cleaned
+
+
+def _complete(user_text: str):
+    """Return the model completion for user_text."""
+    return _read_completion(_invoke(_build_request(user_text)))
+
+
+# Completions are deterministic at temperature 0, so warm containers can serve repeats from memory
+if _TEMPERATURE == 0 and _CACHE_SIZE > 0:
+    _complete = lru_cache(maxsize=_CACHE_SIZE)(_complete)
+
+
+def lambda_handler(event: dict, context) -> dict:
+    request_context = event.get("requestContext")
+    # WebSocket handshakes and disconnects carry no prompt and only need acknowledging
+    if request_context and request_context.get("routeKey") in _WS_LIFECYCLE_ROUTES:
+        return _WS_OK
+
+    payload = _parse_body(event)
+    if payload is None:
+        return _ERR_INVALID_JSON
+    texts = None
+    if isinstance(payload, dict) and "texts" in payload:
+        texts = _extract_texts(payload)
+        if texts is None:
+            return _ERR_TEXTS_REQUIRED
+        if len(texts) > _MAX_BATCH:
+            return _ERR_BATCH_TOO_LARGE
+    else:
+        user_text = _extract_text(payload)
+        if user_text is None:
+            return _ERR_TEXT_REQUIRED
+
+    # Call Bedrock, fanning batches out across the pooled connections
+    try:
+        if texts is None and request_context and "connectionId" in request_context:
+            # WebSocket clients get tokens as they are generated; the chunks are the reply
+            _stream_to_connection(user_text, request_context)
+            return _WS_OK
+        if texts is None:
+            # Success responses are built inline rather than through a helper call
+            body = b'{"completion":' + _dumps(_complete(user_text)) + b"}"
+            return {"statusCode": 200, "headers": _HEADERS, "body": body.decode()}
+        completions = list(_EXECUTOR.map(_complete, texts)) if len(texts) > 1 else [_complete(texts[0])]
+        body = b'{"completions":' + _dumps(completions) + b"}"
+        return {"statusCode": 200, "headers": _HEADERS, "body": body.decode()}
+    except ClientError as e:
+        code = e.response["Error"]["Code"]
+        _LOGGER.error("Bedrock invocation failed: %s", e)
+        return _ERR_RESPONSES.get(code, _ERR_500)
+    except _CONNECTION_ERRORS as e:
+        _LOGGER.error("Bedrock connection failed: %s", e)
+        return _ERR_503
+    except Exception:
+        _LOGGER.exception("Unexpected error invoking Bedrock")
+        return _ERR_500